@@ -1,67 +1,448 @@
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from dataclasses import dataclass
 import streamlit as st
 import requests
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; stdlib json parses the same structures
+    json_loads = json.loads
 
 API_KEY = st.secrets["FMP_API_KEY"]
 BASE_URL = "https://financialmodelingprep.com/api/v3"
+CACHE_DIR = ".cache/fmp"
+
+# Cache lifetimes per endpoint, set by how often the underlying data changes
+PROFILE_TTL = 24 * 3600
+RATIOS_TTL = 12 * 3600
+INCOME_TTL = 30 * 24 * 3600
+# In-memory lifetime of income results; the disk tier enforces INCOME_TTL
+INCOME_MEMORY_TTL = 24 * 3600
+SECTOR_PE_TTL = 24 * 3600
+
+# Popular tickers prefetched in the background once per server process
+WARMUP_TICKERS = ("AAPL", "MSFT", "GOOG", "AMZN", "SPY")
 
 st.set_page_config(page_title="Fundamentals Dashboard", layout="wide")
 st.title("📊 Fundamentals Dashboard")
 
-ticker = st.text_input("Enter Stock Ticker (e.g., AAPL):", "AAPL").upper()
+ticker = st.text_input("Enter Stock Ticker (e.g., AAPL):", "AAPL").strip().upper()
+
+# Shared HTTP session: keeps TLS connections to FMP alive across calls and reruns
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    # Retry 5xx with short exponential backoff and hand the final response
+    # back instead of raising. 429 is deliberately not retried here: sleeping
+    # out Retry-After inside session.get would stall the page, so _get_raw
+    # opens the shared throttle window from it instead
+    retry = Retry(
+        total=4,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry))
+    return session
+
+# Shared worker pool for the endpoint fan-out, created once per server
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="fmp")
+
+class FetchError(Exception):
+    """FMP could not be reached or answered with a server error.
+
+    Raised rather than returned so st.cache_data never stores a transient
+    failure as if the ticker had no data.
+    """
+
+class RateLimitError(FetchError):
+    """FMP is throttling this API key; retry_in is the wait in seconds."""
+
+    def __init__(self, retry_in):
+        super().__init__(f"FMP rate limit reached, retry in {retry_in}s")
+        self.retry_in = retry_in
+
+class AuthError(FetchError):
+    """FMP rejected the API key (401) or the plan doesn't cover the endpoint (403)."""
+
+# Shared throttle window: once FMP answers 429, every session skips the
+# network until it expires instead of piling more requests onto the limit
+@st.cache_resource
+def get_throttle():
+    return {"until": 0.0}
+
+def _retry_after(res, default=60):
+    try:
+        return max(1, int(res.headers.get("Retry-After", default)))
+    except ValueError:
+        return default
+
+# On-disk cache of raw FMP response bodies so repeat tickers survive server
+# restarts; a file's mtime is its fetch time
+class FileCache:
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
 
-# Helper to fetch data from FMP
-def fetch_fmp_data(endpoint):
-    url = f"{BASE_URL}/{endpoint}?apikey={API_KEY}"
-    res = requests.get(url)
+    def _path(self, endpoint, key, params=None):
+        if params:
+            key += "".join(f"_{k}-{v}" for k, v in sorted(params.items()))
+        safe_key = re.sub(r"[^A-Z0-9.^-]", "_", key.upper()) or "_all"
+        return os.path.join(self.root, endpoint, f"{safe_key}.json")
+
+    def get(self, endpoint, key, ttl, params=None):
+        path = self._path(endpoint, key, params)
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def mtime(self, endpoint, key, params=None):
+        try:
+            return os.path.getmtime(self._path(endpoint, key, params))
+        except OSError:
+            return None
+
+    def set(self, endpoint, key, raw, params=None):
+        path = self._path(endpoint, key, params)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unique temp file per writer: sessions and the warm-up thread can
+            # write the same entry at once from threads of one process
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(raw)
+            os.replace(tmp, path)
+        except OSError:
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+file_cache = FileCache()
+
+# Helper to fetch the raw response body for an FMP path. The API key is added
+# here, per request, so it never ends up in cache keys or cache files and a
+# rotated key takes effect without a restart
+def _get_raw(path, params=None):
+    throttle = get_throttle()
+    wait = throttle["until"] - time.time()
+    if wait > 0:
+        raise RateLimitError(math.ceil(wait))
+    try:
+        res = get_session().get(
+            f"{BASE_URL}/{path}", params={**(params or {}), "apikey": API_KEY}, timeout=5
+        )
+    except requests.RequestException as e:
+        # Only the exception type: its text includes the URL, API key and all
+        raise FetchError(f"FMP request to {path} failed ({type(e).__name__})") from e
     if res.status_code == 200:
-        return res.json()
+        return res.content
+    if res.status_code == 429:
+        retry_in = _retry_after(res)
+        throttle["until"] = time.time() + retry_in
+        raise RateLimitError(retry_in)
+    if res.status_code in (401, 403):
+        raise AuthError(f"FMP returned HTTP {res.status_code}")
+    if res.status_code >= 500:
+        raise FetchError(f"FMP returned HTTP {res.status_code}")
+    # Anything else (e.g. 404 for an unknown symbol) means there is no data
     return None
 
+def _parse(raw):
+    if raw is None:
+        return None
+    try:
+        return json_loads(raw)
+    except ValueError:
+        return None
+
+# Helper to fetch an FMP response body through the disk cache; only
+# non-empty JSON lists are kept, so error objects like {"Error Message": ...}
+# (bad or over-quota key) never persist on disk
+def fetch_fmp_raw(endpoint, symbol="", params=None, ttl=3600):
+    raw = file_cache.get(endpoint, symbol, ttl, params)
+    if raw is not None:
+        return raw
+    path = f"{endpoint}/{symbol}" if symbol else endpoint
+    raw = _get_raw(path, params)
+    data = _parse(raw)
+    if not isinstance(data, list) or not data:
+        return None
+    file_cache.set(endpoint, symbol, raw, params)
+    return raw
+
+# Helper to fetch parsed data from FMP
+def fetch_fmp_data(endpoint, symbol="", params=None, ttl=3600):
+    return _parse(fetch_fmp_raw(endpoint, symbol, params, ttl))
+
+# Typed views of the single-row endpoints: just the fields the page reads,
+# each defaulting to None when FMP omits it. Like IncomeSeries these are
+# built outside the cache, which only ever stores plain dicts
+Profile = namedtuple("Profile", ["sector", "lastDiv"], defaults=(None,) * 2)
+RatiosTTM = namedtuple(
+    "RatiosTTM",
+    [
+        "epsTTM", "freeCashFlowTTM", "peRatioTTM", "pegRatioTTM",
+        "returnOnEquityTTM", "currentRatioTTM", "debtEquityRatioTTM",
+    ],
+    defaults=(None,) * 7,
+)
+
+# First record of a single-row FMP response, cut down to record_type's fields,
+# or None for an empty list or an error object (e.g. an unknown ticker)
+def _first(data, record_type):
+    if not isinstance(data, list) or not data or not isinstance(data[0], dict):
+        return None
+    row = data[0]
+    return {field: row.get(field) for field in record_type._fields}
+
+# Build a fetcher for a single-row endpoint. The memory cache holds the response
+# bytes keyed by ticker alone (the unique __qualname__ keeps Streamlit from
+# sharing entries between fetchers built from the same source); bytes are
+# cheaper for Streamlit to store and copy than parsed objects, and orjson
+# re-parses them quickly
+def _make_fetcher(endpoint, ttl, record_type, params=None):
+    def fetch_raw(symbol):
+        return fetch_fmp_raw(endpoint, symbol, params, ttl)
+    fetch_raw.__qualname__ = fetch_raw.__name__ = f"fetch_{endpoint.replace('-', '_')}_raw"
+    cached_raw = st.cache_data(ttl=ttl, show_spinner=False)(fetch_raw)
+
+    def fetch(symbol):
+        return _first(_parse(cached_raw(symbol)), record_type)
+    return fetch
+
+fetch_profile = _make_fetcher("profile", PROFILE_TTL, Profile)
+fetch_ratios_ttm = _make_fetcher("ratios-ttm", RATIOS_TTL, RatiosTTM)
+
+# YoY % change between consecutive rows; one shorter than the input, since
+# the first row has no prior year
+def yoy_pct(values):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (values[1:] / values[:-1] - 1.0) * 100.0
+
+# Income statement as parallel arrays of just the fields the dashboard uses.
+# Built outside the cached fetch: st.cache_data pickles its return value, and
+# a class defined in this script is redefined on every rerun, so instances of
+# it can fail to pickle under concurrent sessions
+@dataclass(frozen=True, slots=True)
+class IncomeSeries:
+    dates: np.ndarray
+    revenue: np.ndarray
+    net_income: np.ndarray
+    revenue_yoy: np.ndarray  # aligned with years[1:]
+    net_income_yoy: np.ndarray  # aligned with years[1:]
+
+    @property
+    def years(self):
+        return self.dates.astype("datetime64[Y]").astype(np.int64) + 1970
+
+def _num(value):
+    return np.nan if value is None else value
+
+# The 30-day lifetime is enforced by the disk tier; the memory entry is kept
+# to a day so an empty result (e.g. a fund with no statements) is re-checked
+# daily, at the cost of a disk read
+@st.cache_data(ttl=INCOME_MEMORY_TTL, show_spinner=False)
+def fetch_income_statement(symbol):
+    data = fetch_fmp_data("income-statement", symbol, {"limit": 10}, INCOME_TTL)
+    if not data or not isinstance(data, list):
+        return None
+    # Rows without a date can't be placed on the YoY timeline, so drop them;
+    # YoY needs at least two years, so a single row counts as no data
+    data = sorted((r for r in data if isinstance(r, dict) and r.get("date")), key=lambda r: r["date"])
+    if len(data) < 2:
+        return None
+    n = len(data)
+    revenue = np.fromiter((_num(r.get("revenue")) for r in data), dtype=np.float64, count=n)
+    net_income = np.fromiter((_num(r.get("netIncome")) for r in data), dtype=np.float64, count=n)
+    # Growth is computed in float64, then everything is stored as float32:
+    # half the cached size, still far more precision than the 2dp display.
+    # Returned as a plain dict of arrays; wrap with IncomeSeries(**...)
+    return {
+        "dates": np.array([r["date"][:10] for r in data], dtype="datetime64[D]"),
+        "revenue": revenue.astype(np.float32),
+        "net_income": net_income.astype(np.float32),
+        "revenue_yoy": yoy_pct(revenue).astype(np.float32),
+        "net_income_yoy": yoy_pct(net_income).astype(np.float32),
+    }
+
+# Sector -> average P/E is the same for every user and ticker, so one shared
+# copy is kept per server and refreshed in the background shortly before it
+# expires; readers keep getting the current map while the refresh runs
+@st.cache_resource
+def _sector_pe_store():
+    return {"map": None, "ts": 0.0, "retry_at": 0.0, "refreshing": False, "lock": threading.Lock()}
+
+SECTOR_PE_ENDPOINT = "stock/sectors-performance-pe-ratios"
+# Wait after an attempt before the next one, so a failing FMP isn't hit on
+# every rerun (cold load) or every read (background refresh)
+SECTOR_PE_RETRY = 5 * 60
+
+def _load_sector_pe(store, refresh=False):
+    store["retry_at"] = time.time() + SECTOR_PE_RETRY
+    # A refresh skips the disk tier (ttl=0) so it really reaches FMP; a cold
+    # load may come from disk, so the map is aged from the file's mtime
+    data = fetch_fmp_data(SECTOR_PE_ENDPOINT, ttl=0 if refresh else SECTOR_PE_TTL)
+    if data and isinstance(data, list):
+        store["map"] = {d.get("sector"): d.get("peRatio") for d in data}
+        fetched_at = None if refresh else file_cache.mtime(SECTOR_PE_ENDPOINT, "")
+        store["ts"] = fetched_at or time.time()
+
+def _refresh_sector_pe(store):
+    try:
+        _load_sector_pe(store, refresh=True)
+    except FetchError:
+        pass
+    finally:
+        store["refreshing"] = False
+
+def fetch_sector_pe_map():
+    store = _sector_pe_store()
+    if time.time() < store["retry_at"]:
+        return store["map"]
+    if store["map"] is None:
+        _load_sector_pe(store)
+    elif time.time() - store["ts"] > SECTOR_PE_TTL * 0.9:
+        with store["lock"]:
+            if not store["refreshing"]:
+                store["refreshing"] = True
+                threading.Thread(target=_refresh_sector_pe, args=(store,), daemon=True).start()
+    return store["map"]
+
+# All per-ticker data as a single cached bundle: a cold load fires every
+# independent FMP request at once (~1 round-trip), a warm load is one cache hit.
+# It lives as long as its shortest-lived part, the TTM ratios. The sector P/E
+# map is not part of it: it is shared by every ticker and refreshes on its own
+@st.cache_data(ttl=RATIOS_TTL, show_spinner=False)
+def fetch_bundle(symbol):
+    tasks = {
+        "income": (fetch_income_statement, symbol),
+        "profile": (fetch_profile, symbol),
+        "ratios": (fetch_ratios_ttm, symbol),
+    }
+    futures = {name: get_executor().submit(*task) for name, task in tasks.items()}
+    return {name: fut.result() for name, fut in futures.items()}
+
+# Prefetch the watchlist once per server in a background thread. Streamlit
+# only runs this script when the first session connects, so warm-up starts on
+# that first visit and shares the worker pool with its own fetch; it is the
+# visitors after it that find warm caches
+@st.cache_resource
+def _warmup():
+    def run():
+        for symbol in WARMUP_TICKERS:
+            try:
+                fetch_bundle(symbol)
+            except (RateLimitError, AuthError):
+                break
+            except Exception:  # one bad ticker must not end warm-up
+                logging.getLogger(__name__).exception("Warm-up fetch failed for %s", symbol)
+    threading.Thread(target=run, daemon=True, name="fmp-warmup").start()
+    return True
+
+_warmup()
+
+if not ticker:
+    st.info("Enter a ticker to load its fundamentals.")
+    st.stop()
+
+# The shared sector map loads alongside the per-ticker bundle
+sector_pe_future = get_executor().submit(fetch_sector_pe_map)
+
+# Fetch errors propagate out of the cached fetchers, so nothing is cached for
+# them and the next rerun tries again
+try:
+    with st.spinner("Loading data..."):
+        data = fetch_bundle(ticker)
+except RateLimitError as e:
+    st.warning(f"FMP rate limit reached — try again in {e.retry_in}s.")
+    st.stop()
+except AuthError:
+    st.error("Financial Modeling Prep rejected the request — check the FMP_API_KEY secret and that your plan covers this data.")
+    st.stop()
+except FetchError:
+    st.error("Financial Modeling Prep is unavailable right now — please retry in a moment.")
+    st.stop()
+
+income = IncomeSeries(**data["income"]) if data["income"] else None
+profile = Profile(**data["profile"]) if data["profile"] else None
+ratios = RatiosTTM(**data["ratios"]) if data["ratios"] else RatiosTTM()
+try:
+    sector_pe_map = sector_pe_future.result()
+except FetchError:
+    sector_pe_map = None
+
+if not profile:
+    st.error(f"No data found for {ticker}. Check the ticker symbol.")
+    st.stop()
+
+# Format a metric once as display text ("–" when FMP has no usable value;
+# numeric strings are accepted since some FMP endpoints return them)
+def fmt_value(value, suffix=""):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return "–"
+    if np.isnan(number):
+        return "–"
+    return f"{number:,.2f}{suffix}"
+
+# Show pre-formatted (label, value) pairs as a row of metrics
+def metric_row(items):
+    for col, (label, value) in zip(st.columns(len(items)), items):
+        col.metric(label, value)
+
 # ------------------ YoY Growth ------------------
 st.subheader("📉 YoY Growth (Revenue & Net Income)")
-income_data = fetch_fmp_data(f"income-statement/{ticker}?limit=10")
-
-if income_data and isinstance(income_data, list):
-    df_income = pd.DataFrame(income_data)
-    if 'date' in df_income.columns and 'revenueGrowth' in df_income.columns and 'netIncomeRatio' in df_income.columns:
-        df_yoy = pd.DataFrame({
-            "Date": df_income["date"],
-            "Revenue YoY %": df_income["revenueGrowth"] * 100,
-            "Net Income YoY %": df_income["netIncomeRatio"] * 100
-        }).set_index("Date").T
-        st.dataframe(df_yoy)
-    else:
-        st.warning("No income statement data available.")
+
+if income is not None:
+    df_yoy = pd.DataFrame(
+        {"Revenue YoY %": income.revenue_yoy, "Net Income YoY %": income.net_income_yoy},
+        index=pd.Index(income.years[1:], name="Year"),
+    ).T
+    st.dataframe(df_yoy.map(fmt_value, suffix="%"))
 else:
     st.warning("No income statement data available.")
 
 # ------------------ Earnings & Cash Flow ------------------
 st.subheader("💰 Earnings & Cash Flow")
-profile = fetch_fmp_data(f"profile/{ticker}")
-ratios = fetch_fmp_data(f"ratios-ttm/{ticker}")
-
-eps = ratios[0].get("epsTTM") if ratios else "N/A"
-fcf = ratios[0].get("freeCashFlowTTM") if ratios else "N/A"
-div_yield = profile[0].get("lastDiv") if profile else "N/A"
 
-earnings_df = pd.DataFrame({
-    "Metric": ["EPS (TTM)", "Free Cash Flow (TTM)", "Dividend Yield"],
-    "Value": [eps, fcf, div_yield]
-})
-earnings_df["Value"] = earnings_df["Value"].astype(str)
-st.dataframe(earnings_df)
+metric_row([
+    ("EPS (TTM)", fmt_value(ratios.epsTTM)),
+    ("Free Cash Flow (TTM)", fmt_value(ratios.freeCashFlowTTM)),
+    ("Dividend Yield", fmt_value(profile.lastDiv)),
+])
 
 # ------------------ Sector P/E Comparison ------------------
 st.subheader("💡 Sector P/E Comparison")
-sector_pe_data = fetch_fmp_data("stock/sectors-performance-pe-ratios")
 
-if sector_pe_data and isinstance(sector_pe_data, list):
-    company_sector = profile[0].get("sector") if profile else None
-    sector_match = next((item for item in sector_pe_data if item["sector"] == company_sector), None)
+if sector_pe_map:
+    company_sector = profile.sector
+    sector_pe = sector_pe_map.get(company_sector)
 
-    if sector_match:
-        st.metric(f"{company_sector} Sector Avg P/E", round(sector_match["peRatio"], 2))
+    if sector_pe is not None:
+        st.metric(f"{company_sector} Sector Avg P/E", fmt_value(sector_pe))
     else:
         st.warning(f"No sector P/E found for {company_sector or 'this ticker'}.")
 else:
@@ -69,18 +450,14 @@ else:
 
 # ------------------ Key Ratios (TTM) ------------------
 st.subheader("📌 Key Ratios (TTM)")
-pe_ratio = ratios[0].get("peRatioTTM") if ratios else "N/A"
-peg_ratio = ratios[0].get("pegRatioTTM") if ratios else "N/A"
-roe = ratios[0].get("returnOnEquityTTM") if ratios else "N/A"
-current_ratio = ratios[0].get("currentRatioTTM") if ratios else "N/A"
-de_ratio = ratios[0].get("debtEquityRatioTTM") if ratios else "N/A"
-
-ratios_df = pd.DataFrame({
-    "Metric": ["PE Ratio (TTM)", "PEG Ratio", "ROE", "Current Ratio", "Debt/Equity"],
-    "Value": [pe_ratio, peg_ratio, roe, current_ratio, de_ratio]
-})
-ratios_df["Value"] = ratios_df["Value"].astype(str)
-st.dataframe(ratios_df)
+
+metric_row([
+    ("PE Ratio (TTM)", fmt_value(ratios.peRatioTTM)),
+    ("PEG Ratio", fmt_value(ratios.pegRatioTTM)),
+    ("ROE", fmt_value(ratios.returnOnEquityTTM)),
+    ("Current Ratio", fmt_value(ratios.currentRatioTTM)),
+    ("Debt/Equity", fmt_value(ratios.debtEquityRatioTTM)),
+])
 
 # ------------------ Footer ------------------
 st.markdown("#### Profitability & Valuation Metrics")